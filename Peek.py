@@ -1,23 +1,14 @@
 # scripts/peek_precedent.py (you can just paste into python)
 import json
-import chromadb
-from chromadb.utils import embedding_functions
 
-client = chromadb.PersistentClient(path="data/chroma")
+from app.chroma_client import CLIENT as client
+from app.embedder import get_embedding_fn
+
+embedding_fn = get_embedding_fn()
 
 # Counts
-pol = client.get_or_create_collection(
-    "PolicyDoc",
-    embedding_function=embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="BAAI/bge-small-en-v1.5"
-    ),
-)
-prec = client.get_or_create_collection(
-    "PrecedentCases",
-    embedding_function=embedding_functions.SentenceTransformerEmbeddingFunction(
-        model_name="BAAI/bge-small-en-v1.5"
-    ),
-)
+pol = client.get_or_create_collection("PolicyDoc", embedding_function=embedding_fn)
+prec = client.get_or_create_collection("PrecedentCases", embedding_function=embedding_fn)
 
 print("PolicyDoc vectors:", pol.count())
 print("PrecedentCases vectors:", prec.count())
@@ -0,0 +1,9 @@
+# app/chroma_client.py
+# One PersistentClient per process. rag and precedent are both imported by
+# app.main; without this each opened its own SQLite connection and HNSW
+# mmap over the same directory.
+import chromadb
+
+CHROMA_DIR = "data/chroma"
+
+CLIENT = chromadb.PersistentClient(path=CHROMA_DIR)
@@ -0,0 +1,115 @@
+# app/embedder.py
+from __future__ import annotations
+import os, pathlib
+from functools import lru_cache
+
+import numpy as np
+from chromadb.utils import embedding_functions
+
+# Same model everywhere — keep in sync with ingest/rag/precedent
+EMBED_MODEL = "BAAI/bge-small-en-v1.5"
+
+# Produced by scripts/export_onnx_embedder.py (dynamic int8, O3 optimized)
+ONNX_MODEL_DIR = pathlib.Path("models/bge-small-int8")
+
+# Produced by scripts/distill_model2vec.py (static token-embedding lookup)
+M2V_MODEL_DIR = pathlib.Path("models/bge-small-m2v")
+
+
+class ONNXEmbed(embedding_functions.EmbeddingFunction):
+    """CPU embedder backed by an int8-quantized ONNX export of the BGE model.
+
+    2-4x faster per call than the fp32 PyTorch path for the short reason
+    strings this app embeds, with negligible retrieval-quality loss.
+    """
+
+    def __init__(self, model_dir: pathlib.Path = ONNX_MODEL_DIR):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        # the export lands in an onnx/ subdirectory, so glob recursively
+        candidates = sorted(model_dir.glob("**/*.onnx"))
+        if not candidates:
+            raise FileNotFoundError(
+                f"No ONNX model under {model_dir}. "
+                "Run: python scripts/export_onnx_embedder.py"
+            )
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = (
+            int(os.getenv("EZ_EMBED_THREADS", "0")) or os.cpu_count() or 1
+        )
+        self._session = ort.InferenceSession(
+            str(candidates[0]),
+            providers=["CPUExecutionProvider"],
+            sess_options=so,
+        )
+        self._input_names = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = AutoTokenizer.from_pretrained(str(model_dir), use_fast=True)
+
+    def __call__(self, input):
+        # one tokenizer call for the whole batch, not per-text
+        enc = self._tokenizer(
+            list(input),
+            padding=True,
+            truncation=True,
+            max_length=512,
+            return_tensors="np",
+        )
+        feeds = {k: v for k, v in enc.items() if k in self._input_names}
+        hidden = self._session.run(None, feeds)[0]          # (B, T, d)
+        # bge-small is a CLS-pooling model (see its sentence-transformers
+        # pooling config) — mean-pooling would put us in a different space
+        # than the SentenceTransformer fallback embeds the corpus in
+        emb = hidden[:, 0]
+        norms = np.linalg.norm(emb, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        return (emb / norms).tolist()
+
+
+class M2VEmbed(embedding_functions.EmbeddingFunction):
+    """Static embedder distilled from the BGE model via model2vec.
+
+    Token-embedding lookup + pooling, pure numpy — orders of magnitude
+    faster than the transformer for the short reason strings here, at some
+    quality cost. NOTE: its vectors live in a different (PCA'd) space, so
+    it must be active for ingest AND query; re-ingest after switching.
+    """
+
+    def __init__(self, model_dir: pathlib.Path = M2V_MODEL_DIR):
+        from model2vec import StaticModel
+
+        if not model_dir.exists():
+            raise FileNotFoundError(
+                f"No model2vec model under {model_dir}. "
+                "Run: python scripts/distill_model2vec.py"
+            )
+        self._model = StaticModel.from_pretrained(str(model_dir))
+
+    def __call__(self, input):
+        return self._model.encode(list(input)).tolist()
+
+
+@lru_cache(maxsize=1)
+def get_embedding_fn():
+    """Embedder singleton shared by rag, precedent, ingest and Peek.
+
+    EZ_EMBEDDER picks the backend: "model2vec", "onnx", "st", or "auto"
+    (default: ONNX int8 if exported, else the fp32 SentenceTransformer).
+    Without the cache each module-level call would load its own ~130 MB
+    model copy.
+    """
+    backend = os.getenv("EZ_EMBEDDER", "auto").lower()
+    if backend == "model2vec":
+        return M2VEmbed()
+    if backend == "onnx":
+        return ONNXEmbed()
+    if backend == "st":
+        return embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=EMBED_MODEL
+        )
+    try:
+        return ONNXEmbed()
+    except Exception:
+        return embedding_functions.SentenceTransformerEmbeddingFunction(
+            model_name=EMBED_MODEL
+        )
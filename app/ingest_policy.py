@@ -1,6 +1,7 @@
 # app/ingest_policy.py
 import re
 import os, uuid, pathlib, re
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Tuple, Optional
 
 # --- Docling (PDF/DOCX/PPTX/HTML) --------------------------------------------
@@ -10,25 +11,25 @@ except Exception:
     DocumentConverter = None  # we'll still ingest .txt/.md if Docling is missing
 
 # --- Vector DB (Chroma) + Embeddings -----------------------------------------
-import chromadb
-from chromadb.utils import embedding_functions
+import numpy as np
+
+from app.chroma_client import CLIENT as _client
+from app.embedder import EMBED_MODEL, get_embedding_fn
 
 DATA_DIR   = pathlib.Path("data/policy_pdfs")   # put your policy files here
 CHROMA_DIR = "data/chroma"
 COLLECTION = "PolicyDoc"
 
-# Choose a strong but lightweight embedding model (CPU-friendly)
-# Options: "BAAI/bge-small-en-v1.5" (better), "sentence-transformers/all-MiniLM-L6-v2" (smaller)
-EMBED_MODEL = "BAAI/bge-small-en-v1.5"
-embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name=EMBED_MODEL
-)
+# int8 ONNX embedder when exported (see scripts/export_onnx_embedder.py)
+embedding_fn = get_embedding_fn()
 
 # --------------------------- Helpers ------------------------------------------
 def _clean(s: str) -> str:
-    # light cleanup to help retrieval
+    # light cleanup to help retrieval; also normalizes whitespace so
+    # chunk() slices rarely need stripping
     s = s.replace("\u00a0", " ")
     s = re.sub(r"[ \t]+", " ", s)
+    s = re.sub(r" ?\n ?", "\n", s)
     s = re.sub(r"\n{3,}", "\n\n", s)
     return s.strip()
 
@@ -39,31 +40,48 @@ def read_textlike(p: pathlib.Path) -> str:
 
 def chunk(text: str, size: int = 1400, overlap: int = 120) -> List[str]:
     # bigger chunks keep the ALLOW/DENY sentence with context
-    out, i = [], 0
-    while i < len(text):
-        piece = text[i:i+size].strip()
-        if piece:
-            out.append(piece)
-        i += max(1, size - overlap)
-    return out
+    # sliding window: start_i = i * (size - overlap), one slice per start
+    step = max(1, size - overlap)
+    starts = range(0, len(text), step)
+    return [s for s in (text[i:i + size].strip() for i in starts) if s]
+
+# one compiled alternation per class → a single linear scan instead of
+# N sequential `kw in s` passes per snippet
+_ALLOW_MARKER_RE = re.compile(r"allow:", re.I)
+_DENY_MARKER_RE  = re.compile(r"deny:", re.I)
+_ALLOW_RE = re.compile(r"bereavement|death|hospital|broken wrist", re.I)
+_DENY_RE  = re.compile(r"flu|common cold|vacation|travel", re.I)
 
 def extract_label(snippet: str) -> Optional[str]:
-    s = snippet.lower()
-    if "allow:" in s: return "allow"
-    if "deny:"  in s: return "deny"
+    # allow: anywhere beats deny:, matching the old chained checks
+    if _ALLOW_MARKER_RE.search(snippet): return "allow"
+    if _DENY_MARKER_RE.search(snippet):  return "deny"
     # light heuristics help early accuracy
-    if any(k in s for k in ["bereavement", "death", "hospital", "broken wrist"]): return "allow"
-    if any(k in s for k in ["flu", "common cold", "vacation", "travel"]): return "deny"
+    if _ALLOW_RE.search(snippet): return "allow"
+    if _DENY_RE.search(snippet):  return "deny"
     return None
 
+# one converter per process (workers reuse it instead of re-initializing)
+_converter: Optional["DocumentConverter"] = None
+
 def convert_with_docling(p: pathlib.Path) -> str:
+    global _converter
     if DocumentConverter is None:
         raise RuntimeError("Docling not available. Install with: pip install -U docling")
-    conv = DocumentConverter()
-    doc = conv.convert(str(p))
+    if _converter is None:
+        _converter = DocumentConverter()
+    doc = _converter.convert(str(p))
     # export to markdown—works well for chunking
     return _clean(doc.document.export_markdown())
 
+def _convert_one(p: pathlib.Path) -> Tuple[pathlib.Path, str]:
+    # worker entry point for the process pool; never raises
+    try:
+        return p, convert_with_docling(p)
+    except Exception as e:
+        print(f"[warn] Skipping {p.name}: {e}")
+        return p, ""
+
 RULE_RE = re.compile(r'(?im)^(ALLOW|DENY)\s*:\s*(.*?)(?=\n(?:ALLOW|DENY)\s*:|\Z)')
 
 def extract_atomic_rules(text: str, source_name: str):
@@ -78,28 +96,38 @@ def extract_atomic_rules(text: str, source_name: str):
     return rules
 
 def load_corpus() -> List[Tuple[str, str, Optional[str]]]:
-    items: List[Tuple[str, str, Optional[str]]] = []
-    for p in sorted(DATA_DIR.glob("*")):
-        # 1) get text (docling for PDFs/DOCX, fallback for .txt/.md)
-        if p.suffix.lower() in {".pdf", ".docx", ".pptx", ".html"}:
-            try:
-                text = convert_with_docling(p)
-            except Exception as e:
-                print(f"[warn] Skipping {p.name}: {e}")
-                text = ""
+    paths = sorted(DATA_DIR.glob("*"))
+    docling_paths = [p for p in paths if p.suffix.lower() in {".pdf", ".docx", ".pptx", ".html"}]
+
+    # 1) Docling conversions in parallel — native parsing dominates ingest
+    # time and releases the GIL, so processes give near-linear speedup
+    converted: dict = {}
+    if docling_paths:
+        if len(docling_paths) > 1 and DocumentConverter is not None:
+            with ProcessPoolExecutor(
+                max_workers=min(os.cpu_count() or 1, len(docling_paths))
+            ) as ex:
+                for p, text in ex.map(_convert_one, docling_paths):
+                    converted[p] = text
         else:
-            text = read_textlike(p)
+            for p in docling_paths:
+                converted[p] = _convert_one(p)[1]
+
+    items: List[Tuple[str, str, Optional[str]]] = []
+    for p in paths:
+        # 2) get text (docling for PDFs/DOCX, fallback for .txt/.md)
+        text = converted[p] if p in converted else read_textlike(p)
 
         if not text:
             continue
 
-        # 2) Prefer atomic ALLOW/DENY rules if present
+        # 3) Prefer atomic ALLOW/DENY rules if present
         rules = extract_atomic_rules(text, p.name)
         if rules:
             items.extend(rules)
             continue
 
-        # 3) Otherwise chunk the text (PDFs without clear markers, etc.)
+        # 4) Otherwise chunk the text (PDFs without clear markers, etc.)
         for c in chunk(text, size=1400, overlap=120):
             items.append((p.name, c, extract_label(c)))  # keep your heuristic fallback
 
@@ -108,8 +136,7 @@ def load_corpus() -> List[Tuple[str, str, Optional[str]]]:
 # --------------------------- Main --------------------------------------------
 def run():
     os.makedirs(DATA_DIR, exist_ok=True)
-    client = chromadb.PersistentClient(path=CHROMA_DIR)
-    col = client.get_or_create_collection(
+    col = _client.get_or_create_collection(
         COLLECTION,
         metadata={"hnsw:space": "cosine"},
         embedding_function=embedding_fn,   # ✅ use strong embeddings
@@ -131,9 +158,32 @@ def run():
     for src, text, label in rows:
         ids.append(str(uuid.uuid4()))
         docs.append(text)
-        metas.append({"source": src, "label": label})
+        # text_lower: chunks are immutable once ingested, so lowercase once
+        # here instead of per-hit on every /request cue scan
+        metas.append({"source": src, "label": label, "text_lower": text.lower()})
+
+    # Embed the whole corpus ourselves in length-sorted batches (smart
+    # batching: similar-length docs pad less) and hand Chroma the vectors,
+    # instead of letting col.add() re-tokenize in small default batches.
+    order = np.argsort([len(d) for d in docs])
+    embs = []
+    for start in range(0, len(order), 64):
+        batch = [docs[i] for i in order[start:start + 64]]
+        embs.extend(embedding_fn(batch))
+    embs = np.asarray(embs, dtype=np.float32)
+    inv = np.empty_like(order)
+    inv[order] = np.arange(len(order))
+    embs = embs[inv]
+
+    col.add(ids=ids, documents=docs, metadatas=metas, embeddings=embs.tolist())
+
+    # Refresh the in-process embedding mirror if the API is live in this process
+    try:
+        from app import rag
+        rag.reload_cache()
+    except Exception:
+        pass
 
-    col.add(ids=ids, documents=docs, metadatas=metas)
     print(
         f"Ingested {len(ids)} policy chunks into '{COLLECTION}' at {CHROMA_DIR} "
         f"(embeddings='{EMBED_MODEL}')"
@@ -1,4 +1,23 @@
 # app/main.py
+import os
+
+# Pin math-library thread counts BEFORE app.rag/app.precedent pull in the
+# embedding model — server processes often default to 1 torch thread, which
+# silently single-threads every encode. Override with EZ_EMBED_THREADS.
+_n_threads = int(os.getenv("EZ_EMBED_THREADS", "0")) or (os.cpu_count() or 4)
+os.environ.setdefault("OMP_NUM_THREADS", str(_n_threads))
+os.environ.setdefault("MKL_NUM_THREADS", str(_n_threads))
+try:
+    import torch
+    torch.set_num_threads(_n_threads)
+    torch.set_num_interop_threads(min(4, _n_threads))
+except Exception:
+    pass  # ONNX-only installs don't ship torch; the embedder sets its own threads
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
 from fastapi import FastAPI, Request, Form
 from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
@@ -8,10 +27,26 @@ from app.rules import auto_approve_beyond_48h, deadline_meta
 from app.rag import policy_lookup, normalize_reason, tag_reason
 from app.precedent import record_precedent
 
+# Blocking embed/query work runs here so the event loop stays free to
+# accept connections while a request is inside the model.
+_EMB_POOL = ThreadPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) - 1))
+
 app = FastAPI(title="EzExtender 2.0 (Local Demo)")
 templates = Jinja2Templates(directory="app/templates")
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
+@app.on_event("startup")
+def _warm():
+    # Pay the model load + first-encode + cache-build cost here instead of
+    # on the first user-visible /request (saves a 2-5 s p99 spike).
+    try:
+        from app import rag, precedent
+        rag.reload_cache()
+        precedent.reload_cache()
+        rag.embedding_fn(["warmup"])
+    except Exception:
+        pass  # warming is best-effort; first request just pays the cost
+
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
@@ -21,7 +56,7 @@ def dashboard(request: Request):
     return templates.TemplateResponse("dashboard.html", {"request": request, "items": []})
 
 @app.post("/request")
-def submit_request(
+async def submit_request(
     deadline_iso: str = Form(...),
     days_requested: int = Form(...),
     reason_text: str = Form(...)
@@ -49,12 +84,14 @@ def submit_request(
             "deadline_meta": dl_meta,
         }
 
-    pol = policy_lookup(reason_text)
+    pol = await asyncio.get_running_loop().run_in_executor(
+        _EMB_POOL, policy_lookup, reason_text
+    )
     pol["deadline_meta"] = dl_meta
     return JSONResponse(pol)
 
 @app.post("/review")
-def review_request(
+async def review_request(
     deadline_iso: str = Form(...),
     days_requested: int = Form(...),
     reason_text: str = Form(...),
@@ -71,11 +108,15 @@ def review_request(
     tag = tag_reason(reason_text)
     meta = {"deadline_iso": deadline_iso, "days_requested": days_requested, "reviewer": reviewer}
 
-    record_precedent(
-        reason_text_raw=reason_text,
-        reason_text_norm=norm,
-        outcome=outcome,
-        tag=tag,
-        meta=meta,
+    await asyncio.get_running_loop().run_in_executor(
+        _EMB_POOL,
+        partial(
+            record_precedent,
+            reason_text_raw=reason_text,
+            reason_text_norm=norm,
+            outcome=outcome,
+            tag=tag,
+            meta=meta,
+        ),
     )
     return {"ok": True, "stored": {"tag": tag, "outcome": outcome}}
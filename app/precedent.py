@@ -1,48 +1,201 @@
 # app/precedent.py
 from __future__ import annotations
-import json, uuid, pathlib, time
+import atexit, json, re, threading, uuid, pathlib, time
 from typing import Optional, Dict, Any
 
-import chromadb
-from chromadb.utils import embedding_functions
+try:
+    import orjson  # ~5x faster loads/dumps on the counter hot path
+except ImportError:
+    orjson = None
+
+import numpy as np
+
+from app.chroma_client import CLIENT as _client
+from app.embedder import get_embedding_fn
 
 CHROMA_DIR = "data/chroma"
-PRECEDENT_JSON = pathlib.Path("data/precedent.json")
+PRECEDENT_JSON = pathlib.Path("data/precedent.json")      # compacted snapshot
+PRECEDENT_LOG  = pathlib.Path("data/precedent.log")       # append-only JSONL events
 PRECEDENT_COLLECTION = "PrecedentCases"
 
-embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="BAAI/bge-small-en-v1.5"
-)
+embedding_fn = get_embedding_fn()
 
-_client = chromadb.PersistentClient(path=CHROMA_DIR)
 _prec_col = _client.get_or_create_collection(
     PRECEDENT_COLLECTION,
     metadata={"hnsw:space": "cosine"},
     embedding_function=embedding_fn,
 )
 
+# ---- In-memory mirror of the precedent collection. At this scale
+# (tens to low-thousands of cases) flat brute-force cosine over a numpy
+# matrix beats walking Chroma's HNSW index; Chroma stays the durable store.
+# fp16 storage is a pessimization here: numpy has no fp16 BLAS path, so
+# the per-query matmul runs far slower than fp32 (see app/rag.py)
+CACHE_DTYPE = np.float32
+
+_cache_embs: np.ndarray | None = None   # (N, d) CACHE_DTYPE, rows L2-normalized
+_cache_docs: list = []
+_cache_metas: list = []
+_cache_count: int = -1                  # PrecedentCases row count the mirror holds
+
+
+def reload_cache() -> None:
+    """Rebuild the in-memory mirror from Chroma (cheap: N is small)."""
+    global _cache_embs, _cache_docs, _cache_metas, _cache_count
+    try:
+        res = _prec_col.get(include=["embeddings", "documents", "metadatas"])
+        embs = res.get("embeddings")
+        if embs is None or len(embs) == 0:
+            _cache_embs, _cache_docs, _cache_metas, _cache_count = None, [], [], 0
+            return
+        E = np.asarray(embs, dtype=np.float32)
+        norms = np.linalg.norm(E, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        _cache_embs = (E / norms).astype(CACHE_DTYPE, copy=False)
+        _cache_docs = list(res.get("documents") or [])
+        _cache_metas = list(res.get("metadatas") or [])
+        _cache_count = len(_cache_docs)
+    except Exception:
+        _cache_embs, _cache_docs, _cache_metas, _cache_count = None, [], [], -1
+
+
+reload_cache()
+
+
+def _cache_append(doc: str, meta: dict, emb) -> None:
+    """Fold one new case into the mirror without a full reload."""
+    global _cache_embs, _cache_count
+    v = np.asarray(emb, dtype=np.float32)
+    n = np.linalg.norm(v)
+    if n > 0.0:
+        v = v / n
+    v = v.astype(CACHE_DTYPE, copy=False)
+    # docs/metas first: concurrent readers index them by row of _cache_embs,
+    # so the matrix must never be longer than the lists
+    _cache_docs.append(doc)
+    _cache_metas.append(meta)
+    if _cache_embs is None:
+        _cache_embs = v[None, :]
+    else:
+        _cache_embs = np.vstack([_cache_embs, v])
+    _cache_count = -1 if _cache_count < 0 else _cache_count + 1
+
+
+def query_precedent(reason_text: str, k: int = 5, query_emb=None):
+    """Nearest past cases, brute-force cosine over the in-memory mirror.
+
+    Pass query_emb to reuse an embedding computed elsewhere (policy_lookup
+    embeds the same normalized reason for the policy side already).
+    Returns rag-style hits: [{'document', 'metadata', 'similarity'}, ...].
+    """
+    # keyed on this collection's row count; same-process writes keep the
+    # mirror in sync via _cache_append, so this only fires for outside writes
+    try:
+        if _prec_col.count() != _cache_count:
+            reload_cache()
+    except Exception:
+        pass
+    if _cache_embs is None:
+        return []
+    if query_emb is None:
+        query_emb = embedding_fn([reason_text])[0]
+    q = np.asarray(query_emb, dtype=np.float32)
+    qn = np.linalg.norm(q)
+    if qn > 0.0:
+        q = q / qn
+    sims = np.asarray(_cache_embs @ q, dtype=np.float32)
+    n = sims.shape[0]
+    top = min(k, n)
+    idx = np.argpartition(-sims, top - 1)[:top] if top < n else np.arange(n)
+    idx = idx[np.argsort(-sims[idx])]
+    return [
+        {
+            "document": _cache_docs[i] or "",
+            "metadata": _cache_metas[i] or {},
+            "similarity": max(0.0, min(1.0, float(sims[i]))),
+        }
+        for i in idx
+    ]
+
+
+def _loads(raw: bytes):
+    return orjson.loads(raw) if orjson else json.loads(raw)
+
+def _dumps_line(data) -> str:
+    # one compact line for the event log
+    return orjson.dumps(data).decode() if orjson else json.dumps(data)
+
 def _safe_load_json(p: pathlib.Path):
     if p.exists():
         try:
-            return json.loads(p.read_text())
+            return _loads(p.read_bytes())
         except Exception:
             pass
     return {}
 
 def _safe_write_json(p: pathlib.Path, data):
     p.parent.mkdir(parents=True, exist_ok=True)
-    p.write_text(json.dumps(data, indent=2))
+    if orjson:
+        p.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+    else:
+        p.write_text(json.dumps(data, indent=2))
+
+# ---- Aggregate counters: snapshot + append-only event log.
+# Each /review appends one JSONL event (O(1)) instead of rewriting the
+# whole counters file; the snapshot is only rebuilt on process exit.
+_counters: Optional[Dict[str, Dict[str, int]]] = None
+
+# /review handlers run on a thread pool; this serializes the counter fold,
+# log append and mirror append so concurrent reviews can't lose updates
+_write_lock = threading.Lock()
+
+def _fold_event(counters: dict, tag: str, outcome: str) -> None:
+    row = counters.setdefault(tag, {"allow": 0, "deny": 0})
+    row[outcome] = int(row.get(outcome, 0)) + 1
+
+def load_counters() -> Dict[str, Dict[str, int]]:
+    """Counters = precedent.json snapshot + replay of the event log."""
+    global _counters
+    if _counters is None:
+        counters = _safe_load_json(PRECEDENT_JSON)
+        if PRECEDENT_LOG.exists():
+            for line in PRECEDENT_LOG.read_text().splitlines():
+                try:
+                    ev = _loads(line)
+                    _fold_event(counters, ev["tag"], ev["outcome"])
+                except Exception:
+                    continue  # skip torn/garbage lines
+        _counters = counters
+    return _counters
+
+def precedent_stats(tag: str) -> dict:
+    return dict(load_counters().get(tag, {}))
+
+def _compact_log() -> None:
+    # fold the log into the snapshot so the next start replays nothing
+    if _counters is None:
+        return
+    try:
+        _safe_write_json(PRECEDENT_JSON, _counters)
+        PRECEDENT_LOG.unlink(missing_ok=True)
+    except Exception:
+        pass
+
+atexit.register(_compact_log)
+
+# compiled once; each pattern is a single scan (priority order preserved)
+_TAG_RES = (
+    ("bereavement",    re.compile(r"bereavement|passed away|funeral|death", re.I)),
+    ("minor_illness",  re.compile(r"flu|cold", re.I)),
+    ("serious_injury", re.compile(r"hospital|injury|broken wrist|surgery", re.I)),
+    ("travel",         re.compile(r"vacation|travel|trip|holiday", re.I)),
+)
 
 def _infer_tag(reason_text: str) -> str:
-    s = (reason_text or "").lower()
-    if any(w in s for w in ("bereavement","passed away","funeral","death")):
-        return "bereavement"
-    if any(w in s for w in ("flu","cold","common cold")):
-        return "minor_illness"
-    if any(w in s for w in ("hospital","injury","broken wrist","surgery")):
-        return "serious_injury"
-    if any(w in s for w in ("vacation","travel","trip","holiday")):
-        return "travel"
+    s = reason_text or ""
+    for tag, pat in _TAG_RES:
+        if pat.search(s):
+            return tag
     return "other"
 
 def record_precedent(
@@ -76,16 +229,22 @@ def record_precedent(
     }
     if meta: m.update(meta)
 
-    # 👉 Embed the RAW text (this is what you’ll retrieve against)
+    # 👉 Embed the RAW text once (this is what you’ll retrieve against);
+    # hand Chroma the vector and fold it straight into the mirror so the
+    # next query neither re-embeds nor reloads.
+    emb = embedding_fn([reason_text_raw])[0]
     _prec_col.add(
         ids=[str(uuid.uuid4())],
         documents=[reason_text_raw],
         metadatas=[m],
+        embeddings=[emb],
     )
 
-    # aggregate counters
-    counters = _safe_load_json(PRECEDENT_JSON)
-    row = counters.get(tag, {"allow": 0, "deny": 0})
-    row[outcome] = int(row.get(outcome, 0)) + 1
-    counters[tag] = row
-    _safe_write_json(PRECEDENT_JSON, counters)
+    with _write_lock:
+        _cache_append(reason_text_raw, m, emb)
+
+        # aggregate counters: O(1) append + in-memory fold (no full rewrite)
+        _fold_event(load_counters(), tag, outcome)
+        PRECEDENT_LOG.parent.mkdir(parents=True, exist_ok=True)
+        with PRECEDENT_LOG.open("a") as f:
+            f.write(_dumps_line({"tag": tag, "outcome": outcome, "ts": ts}) + "\n")
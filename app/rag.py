@@ -1,8 +1,18 @@
 # app/rag.py
 from __future__ import annotations
-import json, pathlib
-import chromadb
-from chromadb.utils import embedding_functions
+import json, os, pathlib, re
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+try:
+    import orjson  # faster parse for the precedent-stats fallback path
+except ImportError:
+    orjson = None
+
+from app.chroma_client import CLIENT as _client
+from app.embedder import get_embedding_fn
 
 # ========================
 # Config
@@ -11,48 +21,161 @@ CHROMA_DIR = "data/chroma"
 POLICY_COLLECTION = "PolicyDoc"          # keep in sync with ingest
 MIN_CONF = 0.60                          # similarity-majority must beat this to recommend
 PRECEDENT_WEIGHT = 0.35                  # 0..1 (policy gets 1-PRECEDENT_WEIGHT)
+RERANK_POOL = 20                         # bi-encoder candidates fed to the reranker
+# Mirror storage dtype. fp16 would halve RAM, but numpy has no fp16 BLAS
+# path and the per-query matmul gets ~20x slower; at this corpus size the
+# RAM saving is irrelevant, so stay on fp32.
+CACHE_DTYPE = np.float32
 
-# ---- Embeddings
-embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-    model_name="BAAI/bge-small-en-v1.5"
-)
+# ---- Embeddings (int8 ONNX when exported, fp32 fallback otherwise)
+embedding_fn = get_embedding_fn()
 
-# ---- Chroma client & policy collection
-_client = chromadb.PersistentClient(path=CHROMA_DIR)
+# ---- Policy collection (client is the process-wide singleton)
 _policy_col = _client.get_or_create_collection(
     POLICY_COLLECTION,
     metadata={"hnsw:space": "cosine"},
     embedding_function=embedding_fn,
 )
 
+# ---- Policy hits as struct-of-arrays (one object per query instead of
+# k dicts; similarity math stays vectorized downstream)
+@dataclass
+class PolicyHits:
+    sims: np.ndarray      # float32 (N,), clipped to [0, 1], best-first
+    labels: np.ndarray    # object (N,), "allow"/"deny"/"" per hit
+    docs: list            # chunk texts
+    sources: list         # metadata "source" per hit
+    metas: list           # full metadata dicts
+
+    def __len__(self) -> int:
+        return int(self.sims.shape[0])
+
+    def take(self, idx) -> "PolicyHits":
+        idx = np.asarray(idx, dtype=np.intp)
+        return PolicyHits(
+            sims=self.sims[idx],
+            labels=self.labels[idx],
+            docs=[self.docs[i] for i in idx],
+            sources=[self.sources[i] for i in idx],
+            metas=[self.metas[i] for i in idx],
+        )
+
+    def head(self, k: int) -> "PolicyHits":
+        return self if len(self) <= k else self.take(np.arange(k))
+
+
+def _make_policy_hits(docs, metas, sims) -> PolicyHits:
+    metas = [m or {} for m in metas]
+    return PolicyHits(
+        sims=np.clip(np.asarray(sims, dtype=np.float32), 0.0, 1.0),
+        labels=np.asarray([(m.get("label") or "").lower() for m in metas], dtype=object),
+        docs=[d or "" for d in docs],
+        sources=[m.get("source", "policy") for m in metas],
+        metas=metas,
+    )
+
+
+# ---- Optional cross-encoder reranker (stage 2: bi-encoder recall is good
+# but ordering near the top is weak; a tiny int8 ONNX cross-encoder fixes
+# which snippet the reviewer actually sees). Disable with EZ_RERANK=0.
+_reranker = None
+if os.getenv("EZ_RERANK", "1") != "0":
+    try:
+        from flashrank import Ranker, RerankRequest
+        _reranker = Ranker(model_name="ms-marco-MiniLM-L-12-v2", cache_dir=".rerank")
+    except Exception:
+        _reranker = None
+
+
+def _rerank_hits(query_text: str, hits: "PolicyHits") -> "PolicyHits":
+    """Reorder hits by cross-encoder score; silent no-op if unavailable."""
+    if _reranker is None or len(hits) < 2:
+        return hits
+    try:
+        passages = [{"id": i, "text": d} for i, d in enumerate(hits.docs)]
+        ranked = _reranker.rerank(RerankRequest(query=query_text, passages=passages))
+        return hits.take([r["id"] for r in ranked])
+    except Exception:
+        return hits
+
+
+# ---- In-memory mirror of the policy collection.
+# Chroma stays the primary store; this is a read-through cache so the hot
+# /request path scores similarities with one numpy matmul instead of a
+# per-query Chroma round-trip.
+_cache_embs: np.ndarray | None = None   # (N, d) CACHE_DTYPE, rows L2-normalized
+_cache_docs: list[str] = []
+_cache_metas: list[dict] = []
+_cache_count: int = -1                  # PolicyDoc row count the mirror was built from
+
+
+def reload_cache() -> None:
+    """Rebuild the in-memory embedding mirror from Chroma (call after ingest)."""
+    global _cache_embs, _cache_docs, _cache_metas, _cache_count
+    try:
+        res = _policy_col.get(include=["embeddings", "documents", "metadatas"])
+        embs = res.get("embeddings")
+        if embs is None or len(embs) == 0:
+            _cache_embs, _cache_docs, _cache_metas, _cache_count = None, [], [], 0
+            return
+        E = np.asarray(embs, dtype=np.float32)
+        norms = np.linalg.norm(E, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        _cache_embs = (E / norms).astype(CACHE_DTYPE, copy=False)
+        _cache_docs = list(res.get("documents") or [])
+        _cache_metas = list(res.get("metadatas") or [])
+        _cache_count = len(_cache_docs)
+    except Exception:
+        # cache is best-effort; queries fall back to Chroma below
+        _cache_embs, _cache_docs, _cache_metas, _cache_count = None, [], [], -1
+
+
+reload_cache()
+
 # ---- Precedent access (vector + aggregates)
 try:
     # uses app/precedent.py from earlier step
     from app.precedent import query_precedent as _precedent_query
+    from app.precedent import precedent_stats as _precedent_stats
     from app.precedent import PRECEDENT_JSON as PRECEDENT_PATH
 except Exception:
-    def _precedent_query(reason_text: str, k: int = 5):
+    def _precedent_query(reason_text: str, k: int = 5, query_emb=None):
         # safe fallback if precedent module not present
         return []
+    _precedent_stats = None
     PRECEDENT_PATH = pathlib.Path("data/precedent.json")
 
 
 # ========================
 # Helpers
 # ========================
+# one compiled pattern per tag → a single scan each instead of N substring
+# passes; checked in priority order, same as the old keyword tuples
+_TAG_RES = (
+    ("bereavement",    re.compile(r"bereavement|passed away|funeral|death", re.I)),
+    ("serious_injury", re.compile(r"hospital|hospitalized|surgery|broken wrist|injury", re.I)),
+    ("minor_illness",  re.compile(r"flu|cold", re.I)),
+    ("travel",         re.compile(r"vacation|travel|trip|holiday", re.I)),
+)
+
 def tag_reason(raw: str) -> str:
-    s = raw.lower()
-    if any(w in s for w in ("bereavement", "passed away", "funeral", "death")):
-        return "bereavement"
-    if any(w in s for w in ("hospital", "hospitalized", "surgery", "broken wrist", "injury")):
-        return "serious_injury"
-    if any(w in s for w in ("flu", "cold", "common cold")):
-        return "minor_illness"
-    if any(w in s for w in ("vacation", "travel", "trip", "holiday")):
-        return "travel"
+    for tag, pat in _TAG_RES:
+        if pat.search(raw):
+            return tag
     return "other"
 
 
+@lru_cache(maxsize=64)
+def _stats_cached(tag: str, mtime_ns: int) -> dict:
+    # mtime_ns keys the entry, so a /review write invalidates it for free
+    try:
+        raw = pathlib.Path(PRECEDENT_PATH).read_bytes()
+        data = orjson.loads(raw) if orjson else json.loads(raw)
+        return data.get(tag, {})
+    except Exception:
+        return {}
+
+
 def _load_precedent_stats(tag: str) -> dict:
     """
     precedent.json shape:
@@ -62,29 +185,67 @@ def _load_precedent_stats(tag: str) -> dict:
       ...
     }
     """
-    if pathlib.Path(PRECEDENT_PATH).exists():
-        try:
-            data = json.loads(pathlib.Path(PRECEDENT_PATH).read_text())
-            return data.get(tag, {})
-        except Exception:
-            pass
-    return {}
+    if _precedent_stats is not None:
+        # in-process counters (snapshot + event log) — no disk read at all
+        return _precedent_stats(tag)
+    p = pathlib.Path(PRECEDENT_PATH)
+    if not p.exists():
+        return {}
+    return _stats_cached(tag, p.stat().st_mtime_ns)
+
+
+# light synonym expansion to help embedding match — one compiled
+# alternation + dict lookup instead of four chained str.replace passes
+_SYN = {
+    "passed away": "death bereavement",
+    "funeral": "death bereavement",
+    "grandfather": "family member",
+    "flu": "common cold minor illness",
+}
+_SYN_RE = re.compile("|".join(map(re.escape, _SYN)))
 
 
+@lru_cache(maxsize=512)
 def normalize_reason(t: str) -> str:
-    # light synonym expansion to help embedding match
-    t = t.lower()
-    return (
-        t.replace("passed away", "death bereavement")
-         .replace("funeral", "death bereavement")
-         .replace("grandfather", "family member")
-         .replace("flu", "common cold minor illness")
-    )
+    return _SYN_RE.sub(lambda m: _SYN[m.group(0)], t.lower())
+
 
+def _to_policy_hits(col, query_text: str, k: int = 5, query_emb=None) -> PolicyHits:
+    # Pick up out-of-process ingests. Keyed on THIS collection's row count —
+    # the sqlite file's mtime also moves on every precedent write, which
+    # would throw the policy mirror away on each submit→review cycle.
+    try:
+        if _policy_col.count() != _cache_count:
+            reload_cache()
+    except Exception:
+        pass
 
-def _to_policy_hits(col, query_text: str, k: int = 5):
+    # Fast path: score against the in-memory mirror (one sgemv, no DB I/O)
+    if _cache_embs is not None:
+        if query_emb is None:
+            query_emb = embedding_fn([query_text])[0]
+        q = np.asarray(query_emb, dtype=np.float32)
+        qn = np.linalg.norm(q)
+        if qn > 0.0:
+            q = q / qn
+        sims = np.asarray(_cache_embs @ q, dtype=np.float32)
+        n = sims.shape[0]
+        top = min(k, n)
+        idx = np.argpartition(-sims, top - 1)[:top] if top < n else np.arange(n)
+        idx = idx[np.argsort(-sims[idx])]
+        return _make_policy_hits(
+            [_cache_docs[i] for i in idx],
+            [_cache_metas[i] for i in idx],
+            sims[idx],
+        )
+
+    # Fallback: empty/unavailable cache (e.g. fresh DB) → query Chroma directly
     res = col.query(
-        query_texts=[query_text],
+        **(
+            {"query_embeddings": [list(map(float, query_emb))]}
+            if query_emb is not None
+            else {"query_texts": [query_text]}
+        ),
         n_results=k,
         include=["documents", "metadatas", "distances"],
     )
@@ -92,36 +253,35 @@ def _to_policy_hits(col, query_text: str, k: int = 5):
     metas = res.get("metadatas", [[]])[0]
     dists = res.get("distances", [[]])[0]
 
-    hits = []
-    for doc, meta, dist in zip(docs, metas, dists):
-        sim = max(0.0, min(1.0, 1.0 - float(dist)))  # cosine distance -> similarity
-        hits.append({
-            "document": doc or "",
-            "metadata": meta or {},
-            "similarity": sim,
-            "source": (meta or {}).get("source", "policy"),
-        })
-    hits.sort(key=lambda h: h["similarity"], reverse=True)
-    return hits
+    sims = 1.0 - np.asarray(dists, dtype=np.float32)  # cosine distance -> similarity
+    order = np.argsort(-sims)
+    return _make_policy_hits(
+        [docs[i] for i in order],
+        [metas[i] for i in order],
+        sims[order],
+    )
 
 
-def _strong_cue_decision(policy_hits, min_sim: float = 0.58):
-    """Fast-path if there are very clear allow/deny phrases in high-sim policy hits."""
-    deny_cues  = ("not sufficient", "not valid", "deny", "insufficient", "not acceptable")
-    allow_cues = ("bereavement", "death", "immediate family", "hospital", "serious injury", "broken wrist")
+# cue alternations are matched against pre-lowered text, so no re.I needed
+_DENY_CUE_RE  = re.compile(r"not sufficient|not valid|deny|insufficient|not acceptable")
+_ALLOW_CUE_RE = re.compile(r"bereavement|death|immediate family|hospital|serious injury|broken wrist")
 
-    strong_deny = False
-    strong_allow = False
 
-    for h in policy_hits:
-        sim = h["similarity"]
-        label = (h["metadata"].get("label") or "").lower()
-        text = h["document"].lower()
+def _strong_cue_decision(policy_hits: PolicyHits, min_sim: float = 0.58):
+    """Fast-path if there are very clear allow/deny phrases in high-sim policy hits."""
+    elig = policy_hits.sims >= min_sim
 
-        if label == "deny" and sim >= min_sim and any(p in text for p in deny_cues):
-            strong_deny = True
-        if label == "allow" and sim >= min_sim and any(p in text for p in allow_cues):
-            strong_allow = True
+    def _text_l(i: int) -> str:
+        return policy_hits.metas[i].get("text_lower") or policy_hits.docs[i].lower()
+
+    strong_deny = any(
+        _DENY_CUE_RE.search(_text_l(i))
+        for i in np.nonzero(elig & (policy_hits.labels == "deny"))[0]
+    )
+    strong_allow = any(
+        _ALLOW_CUE_RE.search(_text_l(i))
+        for i in np.nonzero(elig & (policy_hits.labels == "allow"))[0]
+    )
 
     if strong_deny and not strong_allow:
         return {"recommend": "deny", "confidence": max(min_sim, 0.65)}
@@ -144,21 +304,33 @@ def policy_lookup(reason_text: str, k: int = 5) -> dict:
     tag = tag_reason(reason_text)
     q = normalize_reason(reason_text)
 
-    # 1) Policy RAG
-    policy_hits = _to_policy_hits(_policy_col, q, k=k)
+    # 0) Embed the normalized reason ONCE; policy and precedent both score
+    # against the same vector (was two embed calls per request)
+    q_emb = embedding_fn([q])[0]
+
+    # 1) Policy RAG (retrieve a wider pool when the reranker will cut it down)
+    pool = max(k, RERANK_POOL) if _reranker is not None else k
+    policy_hits = _to_policy_hits(_policy_col, q, k=pool, query_emb=q_emb)
+    policy_hits = _rerank_hits(reason_text, policy_hits).head(k)
 
     # Strong-cue fast path (optional but useful)
     strong = _strong_cue_decision(policy_hits)
 
     # 2) Precedent RAG (nearest past cases)
-    precedent_hits = _precedent_query(q, k=5)  # [{'document','metadata':{'outcome':...}, 'similarity':...}, ...]
+    precedent_hits = _precedent_query(q, k=5, query_emb=q_emb)  # [{'document','metadata':{'outcome':...}, 'similarity':...}, ...]
 
     # 3) Score aggregation (policy + precedent, similarity-weighted)
-    pol_allow = sum(h["similarity"] for h in policy_hits if (h["metadata"].get("label") or "").lower() == "allow")
-    pol_deny  = sum(h["similarity"] for h in policy_hits if (h["metadata"].get("label")  or "").lower() == "deny")
+    # policy side is two masked sums over the SoA arrays
+    pol_allow = float(policy_hits.sims[policy_hits.labels == "allow"].sum())
+    pol_deny  = float(policy_hits.sims[policy_hits.labels == "deny"].sum())
 
-    pre_allow = sum(h["similarity"] for h in precedent_hits if (h["metadata"].get("outcome") or "").lower() == "allow")
-    pre_deny  = sum(h["similarity"] for h in precedent_hits if (h["metadata"].get("outcome")  or "").lower() == "deny")
+    pre_allow = pre_deny = 0.0
+    for h in precedent_hits:
+        out = (h["metadata"].get("outcome") or "").lower()
+        if out == "allow":
+            pre_allow += h["similarity"]
+        elif out == "deny":
+            pre_deny += h["similarity"]
 
     allow_score = (1.0 - PRECEDENT_WEIGHT) * pol_allow + PRECEDENT_WEIGHT * pre_allow
     deny_score  = (1.0 - PRECEDENT_WEIGHT) * pol_deny  + PRECEDENT_WEIGHT * pre_deny
@@ -174,13 +346,13 @@ def policy_lookup(reason_text: str, k: int = 5) -> dict:
 
     # 5) Evidence formatting — ✅ ONLY THE TOP POLICY HIT
     evidence = []
-    if policy_hits:
-        h = policy_hits[0]  # top-1
+    if len(policy_hits):
+        doc = policy_hits.docs[0]  # top-1
         evidence.append({
-            "source": h.get("source", "policy"),
-            "label":  (h["metadata"].get("label") or None),
-            "similarity": round(h["similarity"], 3),
-            "snippet": (h["document"][:300] + ("..." if len(h["document"]) > 300 else "")),
+            "source": policy_hits.sources[0],
+            "label":  (policy_hits.labels[0] or None),
+            "similarity": round(float(policy_hits.sims[0]), 3),
+            "snippet": (doc[:300] + ("..." if len(doc) > 300 else "")),
         })
     # (No precedent hits added here; precedent appears only in the 'precedent' section below.)
 
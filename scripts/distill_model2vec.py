@@ -0,0 +1,12 @@
+# scripts/distill_model2vec.py — one-time distillation for app/embedder.py
+# Collapses the BGE transformer into a static token-embedding lookup table
+# (model2vec) at models/bge-small-m2v/. Select it with EZ_EMBEDDER=model2vec
+# and RE-INGEST: the distilled vectors live in their own space.
+from model2vec.distill import distill
+
+MODEL = "BAAI/bge-small-en-v1.5"
+OUT_DIR = "models/bge-small-m2v"
+
+m = distill(MODEL, pca_dims=256)
+m.save_pretrained(OUT_DIR)
+print(f"Distilled {MODEL} to {OUT_DIR}")
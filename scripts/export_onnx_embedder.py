@@ -0,0 +1,15 @@
+# scripts/export_onnx_embedder.py — one-time export for app/embedder.py
+# Writes an O3-optimized, dynamic-int8-quantized ONNX copy of the embedding
+# model to models/bge-small-int8/ (plus tokenizer files).
+from sentence_transformers import SentenceTransformer
+from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+MODEL = "BAAI/bge-small-en-v1.5"
+OUT_DIR = "models/bge-small-int8"
+
+# second arg is a quantization config ("arm64"/"avx2"/"avx512"/"avx512_vnni"
+# or a QuantizationConfig), not an optimization level
+model = SentenceTransformer(MODEL, backend="onnx")
+export_dynamic_quantized_onnx_model(model, "avx512_vnni", OUT_DIR)
+model.tokenizer.save_pretrained(OUT_DIR)
+print(f"Exported int8 ONNX model to {OUT_DIR}")